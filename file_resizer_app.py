@@ -2,9 +2,10 @@ import sys, os
 from PyQt6.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout,
                              QLabel, QPushButton, QLineEdit, QFrame, QFileDialog, QSizePolicy, QSpacerItem)
 from PyQt6.QtCore import Qt, QSize, QThread, pyqtSignal, QUrl
-from PyQt6.QtGui import QFont, QPixmap, QImage, QDragEnterEvent, QDragLeaveEvent, QDropEvent, QFontMetrics
+from PyQt6.QtGui import QFont, QPixmap, QImage, QDragEnterEvent, QDragLeaveEvent, QDropEvent, QFontMetrics, QImageReader
 import shutil
 import atexit
+import tempfile
 import fitz # Import the PyMuPDF library to handle PDF previews
 
 # This import assumes a file named 'file_resizer_backend.py' exists in the same directory.
@@ -14,11 +15,12 @@ class ResizerWorker(QThread):
     """Worker thread to perform file resizing in the background."""
     finished = pyqtSignal(bool, str)
 
-    def __init__(self, file_path, file_type, target_kb, aspect_ratio=None, parent=None):
+    def __init__(self, file_path, file_type, target_kb, output_base, aspect_ratio=None, parent=None):
         super().__init__(parent)
         self.file_path = file_path
         self.file_type = file_type
         self.target_kb = target_kb
+        self.output_base = output_base # Temp output path without extension
         self.aspect_ratio = aspect_ratio
     
     def run(self):
@@ -26,18 +28,14 @@ class ResizerWorker(QThread):
         success = False
         output_path = None
         
-        # 1. Determine the output path in the code file's location (temp file location)
-        temp_dir = os.path.dirname(os.path.abspath(__file__))
-        base_filename = os.path.splitext(os.path.basename(self.file_path))[0]
-        
         try:
             if self.file_type == "image":
                 # Ensure the output is always .jpg for maximum compression
-                output_path = os.path.join(temp_dir, f"{base_filename}_resized.jpg")
+                output_path = f"{self.output_base}.jpg"
                 success = resize_image(self.file_path, output_path, self.target_kb, self.aspect_ratio)
             elif self.file_type == "pdf":
                 # Ensure the output is always .pdf
-                output_path = os.path.join(temp_dir, f"{base_filename}_resized.pdf")
+                output_path = f"{self.output_base}.pdf"
                 success = resize_pdf(self.file_path, output_path, self.target_kb)
         except Exception as e:
             print(f"An error occurred during resizing: {e}")
@@ -46,6 +44,40 @@ class ResizerWorker(QThread):
             
         self.finished.emit(success, output_path)
 
+class PreviewWorker(QThread):
+    """Worker thread to render the first page of a PDF for the preview."""
+    finished = pyqtSignal(str, QImage)
+
+    def __init__(self, file_path, target_size, parent=None):
+        super().__init__(parent)
+        self.file_path = file_path
+        self.target_size = target_size
+
+    def run(self):
+        """Renders the preview image; emits a null QImage if rendering fails."""
+        try:
+            # Open the PDF file and get the first page
+            doc = fitz.open(self.file_path)
+            page = doc.load_page(0)
+
+            # Render the page directly at the preview size instead of at native
+            # resolution followed by a Qt downscale
+            rect = page.rect
+            scale = min(self.target_size.width() / rect.width, self.target_size.height() / rect.height)
+            pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+
+            # Convert the PyMuPDF pixmap to a PyQt6 QImage. The copy is required because
+            # the QImage only borrows pix.samples, which is released with the pixmap.
+            qt_image = QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format.Format_RGB888).copy()
+
+            doc.close()
+        except Exception as e:
+            # Handle cases where the PDF can't be rendered
+            print(f"Error rendering PDF preview: {e}")
+            qt_image = QImage()
+
+        self.finished.emit(self.file_path, qt_image)
+
 class FileResizerApp(QWidget):
     def __init__(self):
         super().__init__()
@@ -55,12 +87,22 @@ class FileResizerApp(QWidget):
         self.current_file_path = None
         self.resized_file_path = None
         self.current_file_type = "image"
+        self.cached_preview = None # Scaled preview of the current file
+        self.cached_preview_key = None # (path, mtime_ns, size) the preview was made from
+        
+        # Resized files go to a private temp directory that is removed on exit.
+        # Outputs rotate through a fixed set of slot names, so the directory never
+        # accumulates files even if a deletion fails.
+        self.temp_dir = tempfile.mkdtemp(prefix="file_resizer_")
+        self.temp_slots = 2
+        self.resize_count = 0
         
         self.initUI()
         self.showMaximized()
         
-        # Register cleanup function to run on application exit
+        # Register cleanup functions to run on application exit
         atexit.register(self.clean_temp_file)
+        atexit.register(shutil.rmtree, self.temp_dir, ignore_errors=True)
 
     def set_dark_theme(self):
         """Applies a dark theme to the application."""
@@ -158,6 +200,8 @@ class FileResizerApp(QWidget):
         self.file_name_label = QLabel("No file selected")
         self.file_name_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.file_name_label.setWordWrap(False) # Keep this as False
+        # Font metrics used to elide the file name; the label font never changes
+        self.file_name_metrics = QFontMetrics(self.file_name_label.font())
 
         browse_button = QPushButton("Browse Files")
         browse_button.clicked.connect(self.open_file_dialog)
@@ -294,70 +338,91 @@ class FileResizerApp(QWidget):
         A helper method to process a newly selected file from either
         the browse button or a drag-and-drop action.
         """
+        # Re-selecting the current file keeps its preview (and any resized result),
+        # unless the file changed on disk since the preview was made
+        file_stat = os.stat(file_path)
+        preview_key = (file_path, file_stat.st_mtime_ns, file_stat.st_size)
+        if preview_key == self.cached_preview_key and self.cached_preview is not None:
+            self.upload_preview_label.setPixmap(self.cached_preview)
+            self.upload_preview_label.show()
+            self.drag_drop_text.hide()
+            self.status_label.setText("")
+            return
+
         self.clean_temp_file()
         self.current_file_path = file_path
+        self.cached_preview = None
+        self.cached_preview_key = preview_key
         
-        original_size_kb = os.path.getsize(file_path) / 1024
+        original_size_kb = file_stat.st_size / 1024
         file_name = os.path.basename(file_path)
         
         # Create a full string including the size
         full_text = f"{file_name} ({original_size_kb:.2f} KB)"
         
-        # Get font metrics for the label
-        metrics = QFontMetrics(self.file_name_label.font())
-        
         # Get the maximum width of the label
         max_width = self.file_name_label.width()
         
         # Elide the text from the middle if it's too long
-        elided_text = metrics.elidedText(full_text, Qt.TextElideMode.ElideMiddle, max_width)
+        elided_text = self.file_name_metrics.elidedText(full_text, Qt.TextElideMode.ElideMiddle, max_width)
 
         self.file_name_label.setText(elided_text)
         self.resized_info_label.setText("") # Clear previous results
 
         # Show a preview of the original file
         if self.current_file_type == "image":
-            pixmap = QPixmap(file_path)
-            scaled_pixmap = pixmap.scaled(self.upload_preview_label.size(), Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+            # Decode straight to the preview size. For JPEG sources Qt's reader passes
+            # the scaled size to libjpeg (1/2, 1/4 or 1/8 DCT-domain scaling), the same
+            # shrink-on-load that Pillow's draft() provides, so no full decode happens.
+            reader = QImageReader(file_path)
+            size = reader.size()
+            target = self.upload_preview_label.maximumSize()
+            if size.isValid():
+                scale = min(target.width() / size.width(), target.height() / size.height(), 1.0)
+                reader.setScaledSize(size * scale)
+            scaled_pixmap = QPixmap.fromImage(reader.read())
             self.upload_preview_label.setPixmap(scaled_pixmap)
+            self.cached_preview = scaled_pixmap
             self.upload_preview_label.show()
             self.drag_drop_text.hide()
         elif self.current_file_type == "pdf":
-            try:
-                # Open the PDF file and get the first page
-                doc = fitz.open(file_path)
-                page = doc.load_page(0)
-                
-                # Render the page to a pixmap
-                pix = page.get_pixmap()
-                
-                # Convert the PyMuPDF pixmap to a PyQt6 QImage
-                qt_image = QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format.Format_RGB888)
-                
-                # Convert the QImage to a QPixmap for the label
-                pixmap = QPixmap.fromImage(qt_image)
-                
-                scaled_pixmap = pixmap.scaled(self.upload_preview_label.size(), Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
-                self.upload_preview_label.setPixmap(scaled_pixmap)
-                self.upload_preview_label.show()
-                self.drag_drop_text.hide()
-                
-                doc.close()
-            except Exception as e:
-                # Handle cases where the PDF can't be rendered
-                print(f"Error rendering PDF preview: {e}")
-                self.status_label.setText("Error: Could not render PDF preview.")
-                self.upload_preview_label.hide()
-                self.drag_drop_text.show()
+            # Render the PDF preview in the background to keep the UI responsive.
+            # The worker is parented to the window so it outlives this reference.
+            self.upload_preview_label.hide()
+            self.drag_drop_text.setText("Loading preview...")
+            self.drag_drop_text.show()
+            self.preview_worker = PreviewWorker(file_path, self.upload_preview_label.maximumSize(), self)
+            self.preview_worker.finished.connect(self.on_preview_ready)
+            self.preview_worker.start()
         else:
             self.upload_preview_label.hide()
             self.drag_drop_text.show()
         
         self.status_label.setText("")
 
+    def on_preview_ready(self, file_path, qt_image):
+        """Handles the rendered PDF preview from the preview worker thread."""
+        # Ignore results for a file that is no longer selected
+        if file_path != self.current_file_path or self.current_file_type != "pdf":
+            return
+
+        if qt_image.isNull():
+            self.status_label.setText("Error: Could not render PDF preview.")
+            self.upload_preview_label.hide()
+            self.drag_drop_text.setText("Drag and drop PDF here")
+            self.drag_drop_text.show()
+            return
+
+        # The page was rendered at the preview size, so no further scaling is needed
+        self.cached_preview = QPixmap.fromImage(qt_image)
+        self.upload_preview_label.setPixmap(self.cached_preview)
+        self.upload_preview_label.show()
+        self.drag_drop_text.hide()
+
     def on_file_type_selected(self, file_type):
         """Updates the UI based on the selected file type (image/pdf)."""
         self.current_file_type = file_type
+        self.cached_preview = None
         
         if file_type == "image":
             self.image_btn.setObjectName("selected_btn")
@@ -376,8 +441,11 @@ class FileResizerApp(QWidget):
             self.drag_drop_text.show()
             self.drag_drop_text.setText("Drag and drop PDF here")
             
-        self.image_btn.setStyleSheet(self.styleSheet())
-        self.pdf_btn.setStyleSheet(self.styleSheet())
+        # Re-polish only the toggled buttons so the objectName selectors re-apply,
+        # without re-parsing the stylesheet for the whole widget tree
+        for button in (self.image_btn, self.pdf_btn):
+            button.style().unpolish(button)
+            button.style().polish(button)
 
     def open_file_dialog(self):
         """Opens a file dialog to select an image or PDF file."""
@@ -424,7 +492,9 @@ class FileResizerApp(QWidget):
                 aspect_ratio = None
         
         # Create and start the worker thread
-        self.worker = ResizerWorker(self.current_file_path, self.current_file_type, target_kb, aspect_ratio)
+        output_base = os.path.join(self.temp_dir, f"resized_{self.resize_count % self.temp_slots}")
+        self.resize_count += 1
+        self.worker = ResizerWorker(self.current_file_path, self.current_file_type, target_kb, output_base, aspect_ratio)
         self.worker.finished.connect(self.on_resizing_finished)
         self.worker.start()
 
@@ -435,7 +505,7 @@ class FileResizerApp(QWidget):
 
         if success:
             self.resized_file_path = output
-            file_name = os.path.basename(output)
+            file_name = self.resized_file_name()
             file_size_kb = os.path.getsize(output) / 1024
             self.resized_info_label.setText(f"SUCCESS: {file_name} ({file_size_kb:.2f} KB)")
             self.status_label.setText("File resized successfully! Ready to download.")
@@ -444,6 +514,12 @@ class FileResizerApp(QWidget):
             # If resizing fails, the path is invalid, so clear it.
             self.resized_file_path = None
 
+    def resized_file_name(self):
+        """Returns the user-facing name of the resized file, based on the original name."""
+        base_filename = os.path.splitext(os.path.basename(self.current_file_path))[0]
+        extension = os.path.splitext(self.resized_file_path)[1]
+        return f"{base_filename}_resized{extension}"
+
     def download_file(self):
         """
         Opens a save file dialog to let the user save the resized file,
@@ -453,7 +529,7 @@ class FileResizerApp(QWidget):
             self.status_label.setText("Please resize a file first!")
             return
         
-        file_name = os.path.basename(self.resized_file_path)
+        file_name = self.resized_file_name()
         
         # Determine the file filter and default extension
         extension = os.path.splitext(file_name)[1]
@@ -467,11 +543,16 @@ class FileResizerApp(QWidget):
         
         if save_path:
             try:
-                # Copy the temporary file to the user-selected location
-                shutil.copy(self.resized_file_path, save_path)
+                # Move the temporary file to the user-selected location. A rename is
+                # a metadata update on the same filesystem; shutil.move falls back to
+                # copy-and-delete across filesystems.
+                try:
+                    os.replace(self.resized_file_path, save_path)
+                except OSError:
+                    shutil.move(self.resized_file_path, save_path)
                 self.status_label.setText(f"File saved to: {save_path}")
                 
-                # 3. Delete the temporary file after successful copy/download
+                # 3. Clear the moved temporary file's reference after download
                 self.clean_temp_file()
                 self.download_btn.setEnabled(False)
                 self.resized_info_label.setText(f"Download complete. Temporary file deleted.")
@@ -487,6 +568,8 @@ class FileResizerApp(QWidget):
         
         self.current_file_path = None
         self.resized_file_path = None
+        self.cached_preview = None
+        self.cached_preview_key = None
         
         # Reset the border style explicitly
         self.upload_frame.setStyleSheet("QFrame { border: 2px solid #4f545c; }")
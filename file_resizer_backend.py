@@ -1,16 +1,66 @@
 import os
-import uuid 
+import math
+import shutil
+import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from io import BytesIO
-from PIL import Image
+from PIL import Image, features
 import fitz  # PyMuPDF
 
+logger = logging.getLogger(__name__)
+
+try:
+    import pyvips  # Optional: faster, streaming image resampling
+except (ImportError, OSError):
+    # OSError is raised when the bindings are installed but libvips itself is not
+    pyvips = None
+
+try:
+    # Optional: libjpeg-turbo bindings for faster trial JPEG encodes
+    import numpy as np
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJPF_GRAY, TJSAMP_420, TJSAMP_GRAY
+    _turbo_jpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    # OSError/RuntimeError are raised when the shared libturbojpeg cannot be found
+    _turbo_jpeg = None
+
+try:
+    import mozjpeg_lossless_optimization  # Optional: lossless JPEG re-optimization
+except ImportError:
+    mozjpeg_lossless_optimization = None
+
+try:
+    import pypdfium2 as pdfium  # Optional: PDFium page rasterizer
+except ImportError:
+    pdfium = None
+
+# Page rasterizer for the destructive PDF pass: "fitz" (default) or "pdfium".
+# Document editing and serialization always use PyMuPDF.
+_PDF_BACKEND = os.environ.get("FR_PDF_BACKEND", "fitz").strip().lower()
+if _PDF_BACKEND == "pdfium" and pdfium is None:
+    logger.warning("FR_PDF_BACKEND=pdfium but pypdfium2 is not installed; using PyMuPDF.")
+    _PDF_BACKEND = "fitz"
+elif _PDF_BACKEND not in ("fitz", "pdfium"):
+    logger.warning("Unknown FR_PDF_BACKEND '%s'; using PyMuPDF.", _PDF_BACKEND)
+    _PDF_BACKEND = "fitz"
+
+# Every JPEG encode here (page rasters, embedded images, trial encodes) goes through
+# Pillow, which is only SIMD-accelerated when built against libjpeg-turbo
+try:
+    if not features.check_feature("libjpeg_turbo"):
+        logger.warning("Pillow is not built with libjpeg-turbo; JPEG encoding will be slower.")
+except ValueError:
+    pass  # Older Pillow releases do not report this feature
+
 # --- Helper function for robust PyMuPDF compression ---
 
 def _get_compressed_jpeg_bytes(pix: fitz.Pixmap, quality: int) -> bytes:
     """
-    Saves a Pixmap to a temporary file path with specified JPEG quality, reads the
-    bytes, and deletes the temporary file. This works around PyMuPDF's low-level
-    C API limitations when saving to BytesIO with quality parameters.
+    Encodes a Pixmap as JPEG entirely in memory via Pixmap.pil_tobytes (Pillow),
+    avoiding the temporary-file round trip that PyMuPDF's own JPEG writer requires.
     
     Args:
         pix (fitz.Pixmap): The PyMuPDF Pixmap object to compress.
@@ -19,119 +69,787 @@ def _get_compressed_jpeg_bytes(pix: fitz.Pixmap, quality: int) -> bytes:
     Returns:
         bytes: The compressed JPEG data.
     """
-    # Create a unique temporary filename in the current working directory
-    temp_filename = f"temp_comp_img_{uuid.uuid4()}.jpg"
-    
-    try:
-        # Save to the temporary file path, using jpg_quality
-        pix.save(temp_filename, "jpeg", jpg_quality=quality)
-        
-        # Read the resulting compressed file content
-        with open(temp_filename, "rb") as f:
-            img_bytes = f.read()
-        
-        return img_bytes
-        
-    finally:
-        # Ensure the temporary file is deleted, even if an error occurred
-        if os.path.exists(temp_filename):
-            os.remove(temp_filename)
+    # JPEG stores neither alpha nor CMYK-style colorspaces here, so normalize first
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    if pix.n not in (1, 3):
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+
+    return pix.pil_tobytes("JPEG", optimize=True, quality=int(quality))
             
+# Standard IJG luminance quantization table (quality 50), used to estimate the
+# quality an existing JPEG was saved at
+_STD_LUMINANCE_TABLE = (
+    16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56, 14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99,
+)
+
+
+def _estimate_jpeg_quality(img: Image.Image) -> int:
+    """
+    Estimates the quality setting of a JPEG from its luminance quantization table,
+    by inverting the IJG quality scaling against the standard table.
+
+    Args:
+        img (Image.Image): A JPEG image opened with Pillow.
+
+    Returns:
+        int: The estimated quality (1-100), or 100 if the tables are unavailable.
+    """
+    tables = getattr(img, "quantization", None)
+    if not tables or 0 not in tables:
+        return 100
+    scale = 100 * sum(tables[0]) / sum(_STD_LUMINANCE_TABLE)
+    quality = 5000 / scale if scale > 100 else (200 - scale) / 2
+    return int(max(1, min(100, round(quality))))
+
+
+def _recompress_xref(doc: fitz.Document, xref: int, quality: int) -> bytes:
+    """
+    Recompresses one embedded image as JPEG for the non-destructive pass.
+    Images already stored as JPEG (DCTDecode) at or below the requested quality
+    are left untouched; higher-quality JPEGs are re-saved straight from their
+    stream with Pillow, skipping the PyMuPDF Pixmap decode. A result is only
+    returned when it is smaller than the stream it would replace.
+
+    Args:
+        doc (fitz.Document): The open PyMuPDF document.
+        xref (int): The cross-reference number of the image.
+        quality (int): JPEG quality (0-100).
+
+    Returns:
+        bytes: The recompressed JPEG data, or None if the image should be kept.
+    """
+    # Stencil masks and colour-key masked images would be broken by lossy encoding
+    if doc.xref_get_key(xref, "ImageMask")[1] == "true" or doc.xref_get_key(xref, "Mask")[0] == "array":
+        return None
+
+    # The raw stream is read without decoding; extract_image would re-encode
+    # every non-JPEG image as PNG just to report its format
+    raw = doc.xref_stream_raw(xref)
+    if doc.xref_get_key(xref, "Filter")[1] == "/DCTDecode":
+        img = Image.open(BytesIO(raw))
+        if _estimate_jpeg_quality(img) <= quality + 5:
+            return None
+        # CMYK and other JPEG colorspaces, and inverted /Decode arrays, go through
+        # the Pixmap conversion below
+        if img.mode in ("RGB", "L") and doc.xref_get_key(xref, "Decode")[0] == "null":
+            buf = BytesIO()
+            img.save(buf, format="JPEG", quality=quality, optimize=True, progressive=True)
+            return buf.getvalue() if buf.tell() < len(raw) else None
+
+    img_bytes = _get_compressed_jpeg_bytes(fitz.Pixmap(doc, xref), quality)
+    return img_bytes if len(img_bytes) < len(raw) else None
+
+
+def _colorspace_components(doc: fitz.Document, xref: int) -> int:
+    """
+    Returns the number of components of an image's /ColorSpace, for the RGB and gray
+    families (device, calibrated or ICC-based) that a JPEG can carry unchanged.
+
+    Args:
+        doc (fitz.Document): The open PyMuPDF document.
+        xref (int): The cross-reference number of the image.
+
+    Returns:
+        int: 1 or 3, or None for any other colorspace (CMYK, Indexed, Lab, DeviceN...).
+    """
+    kind, value = doc.xref_get_key(xref, "ColorSpace")
+    if kind == "xref":
+        value = doc.xref_object(int(value.split()[0]), compressed=True)
+    tokens = value.replace("[", " ").replace("]", " ").split()
+    if not tokens:
+        return None
+    if tokens[0] in ("/DeviceRGB", "/CalRGB"):
+        return 3
+    if tokens[0] in ("/DeviceGray", "/CalGray"):
+        return 1
+    if tokens[0] == "/ICCBased" and len(tokens) >= 2:
+        n_kind, n = doc.xref_get_key(int(tokens[1]), "N")
+        if n_kind == "int" and int(n) in (1, 3):
+            return int(n)
+    return None
+
+
+def _replace_image_stream(doc: fitz.Document, xref: int, jpeg_bytes: bytes) -> None:
+    """
+    Replaces an image XObject's stream with JPEG data in place, so every page that
+    references the xref picks up the new image. The image dictionary is rewritten
+    to describe the JPEG; other entries such as /SMask (soft transparency) are kept,
+    and so is the /ColorSpace (including ICC profiles) unless the encode converted it.
+
+    Args:
+        doc (fitz.Document): The open PyMuPDF document.
+        xref (int): The cross-reference number of the image.
+        jpeg_bytes (bytes): The new JPEG data.
+    """
+    # Only the header is parsed, for the dimensions and component count
+    img = Image.open(BytesIO(jpeg_bytes))
+    width, height = img.size
+    components = 1 if img.mode == "L" else 3
+    # Both encode paths keep the samples in the image's own colorspace when it has
+    # 1 or 3 components, so only converted images (e.g. CMYK) need a new one
+    keep_colorspace = _colorspace_components(doc, xref) == components
+
+    # compress=False stores the bytes as-is and drops the old /Filter
+    doc.update_stream(xref, jpeg_bytes, compress=False)
+    doc.xref_set_key(xref, "Filter", "/DCTDecode")
+    doc.xref_set_key(xref, "DecodeParms", "null")
+    doc.xref_set_key(xref, "Decode", "null")
+    doc.xref_set_key(xref, "Width", str(width))
+    doc.xref_set_key(xref, "Height", str(height))
+    doc.xref_set_key(xref, "BitsPerComponent", "8")
+    if not keep_colorspace:
+        doc.xref_set_key(xref, "ColorSpace", "/DeviceGray" if components == 1 else "/DeviceRGB")
+
+
 # --- Core PDF Resizing Logic (using Binary Search) ---
 
-def _rasterize_to_target(input_path: str, output_path: str, target_kb: int, scale_factor: float = 0.8) -> bool:
+def _render_page(input_path: str, page_num: int, scale_factor: float) -> fitz.Pixmap:
+    """
+    Rasterizes a single page at the given scale factor with PyMuPDF.
+
+    Args:
+        input_path (str): The path to the input PDF file.
+        page_num (int): The zero-based page number.
+        scale_factor (float): The factor by which to scale down the page resolution.
+
+    Returns:
+        fitz.Pixmap: The rendered RGB page (no alpha channel).
+    """
+    with fitz.open(input_path) as doc:
+        # Create the transformation matrix based on scale factor
+        matrix = fitz.Matrix(scale_factor, scale_factor)
+        return doc.load_page(page_num).get_pixmap(matrix=matrix, alpha=False)
+
+
+def _render_page_pdfium(input_path: str, page_num: int, scale_factor: float) -> Image.Image:
+    """
+    Rasterizes a single page at the given scale factor with PDFium.
+
+    Args:
+        input_path (str): The path to the input PDF file.
+        page_num (int): The zero-based page number.
+        scale_factor (float): The factor by which to scale down the page resolution.
+
+    Returns:
+        Image.Image: The rendered RGB page.
+    """
+    pdf = pdfium.PdfDocument(input_path)
+    try:
+        page = pdf[page_num]
+        # scale=1 is 72 DPI, matching PyMuPDF's identity matrix
+        img = page.render(scale=scale_factor).to_pil().convert("RGB")
+        page.close()
+        return img
+    finally:
+        pdf.close()
+
+
+# Rendered pages of this process, for a single (input_path, mtime, scale_factor) at a
+# time: the quality search re-encodes the same pages at one scale, so the cache
+# holds at most one render per page and is replaced when the scale changes
+_page_cache_key = None
+_page_cache = {}
+
+
+def _cached_page(input_path: str, mtime: float, page_num: int, scale_factor: float):
+    """
+    Returns the rendered page from this process's page cache, rendering it with the
+    selected backend on a miss. The file's modification time is part of the key so
+    edited inputs are re-rendered.
+
+    Args:
+        input_path (str): The path to the input PDF file.
+        mtime (float): The input file's modification time (cache key only).
+        page_num (int): The zero-based page number.
+        scale_factor (float): The factor by which to scale down the page resolution.
+
+    Returns:
+        fitz.Pixmap or Image.Image: The rendered page (a PIL image for the pdfium backend).
+    """
+    global _page_cache_key
+    key = (input_path, mtime, scale_factor)
+    if key != _page_cache_key:
+        _page_cache.clear()
+        _page_cache_key = key
+    page = _page_cache.get(page_num)
+    if page is None:
+        render = _render_page_pdfium if _PDF_BACKEND == "pdfium" else _render_page
+        page = _page_cache[page_num] = render(input_path, page_num, scale_factor)
+    return page
+
+
+def _clear_page_cache() -> None:
+    """Releases this process's cached page renders (and their sample memory)."""
+    global _page_cache_key
+    _page_cache.clear()
+    _page_cache_key = None
+
+
+def _encode_page(input_path: str, mtime: float, page_num: int, scale_factor: float, quality: int) -> tuple:
+    """
+    Renders one page and compresses it as JPEG.
+
+    Args:
+        input_path (str): The path to the input PDF file.
+        mtime (float): The input file's modification time (cache key only).
+        page_num (int): The zero-based page number.
+        scale_factor (float): The factor by which to scale down the page resolution.
+        quality (int): JPEG quality (0-100).
+
+    Returns:
+        tuple: (width, height, jpeg_bytes) of the rendered page.
+    """
+    page = _cached_page(input_path, mtime, page_num, scale_factor)
+    if isinstance(page, Image.Image):
+        buf = BytesIO()
+        page.save(buf, format="JPEG", quality=int(quality), optimize=True)
+        return page.width, page.height, buf.getvalue()
+    return page.width, page.height, _get_compressed_jpeg_bytes(page, quality)
+
+
+def _encode_page_range(input_path: str, mtime: float, start: int, stop: int, scale_factor: float,
+                       quality: int) -> list:
+    """
+    Encodes a contiguous range of pages. Defined at module level so it can run in a
+    worker process, each of which opens the document independently.
+
+    Args:
+        input_path (str): The path to the input PDF file.
+        mtime (float): The input file's modification time (cache key only).
+        start (int): The first zero-based page number.
+        stop (int): One past the last page number.
+        scale_factor (float): The factor by which to scale down the page resolution.
+        quality (int): JPEG quality (0-100).
+
+    Returns:
+        list: One (width, height, jpeg_bytes) tuple per page, in page order.
+    """
+    return [_encode_page(input_path, mtime, page_num, scale_factor, quality)
+            for page_num in range(start, stop)]
+
+
+def _encode_pages(input_path: str, page_count: int, scale_factor: float, quality: int, workers=None) -> list:
     """
-    Rasterize PDF pages to images and uses binary search on JPEG quality
-    to find the best quality that results in a file size <= target_kb.
+    Renders and JPEG-compresses every page of a document.
+
+    Args:
+        input_path (str): The path to the input PDF file.
+        page_count (int): The number of pages in the document.
+        scale_factor (float): The factor by which to scale down the page resolution.
+        quality (int): JPEG quality (0-100) used for every page image.
+        workers (list, optional): Single-process executors from _page_workers. Each
+            always gets the same contiguous page range, so its page cache is hit on
+            every probe at the same scale. Pages are encoded in this process when None.
+
+    Returns:
+        list: One (width, height, jpeg_bytes) tuple per page, in page order.
+    """
+    mtime = os.path.getmtime(input_path)
+    if not workers:
+        return _encode_page_range(input_path, mtime, 0, page_count, scale_factor, quality)
+
+    bounds = [page_count * i // len(workers) for i in range(len(workers) + 1)]
+    futures = [worker.submit(_encode_page_range, input_path, mtime, start, stop, scale_factor, quality)
+               for worker, start, stop in zip(workers, bounds, bounds[1:])]
+    try:
+        return [page for future in futures for page in future.result()]
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory); start fresh workers on the next call
+        _shutdown_page_workers()
+        raise
+
+
+# Single-process executors kept for the life of the app, so the spawn start-up cost
+# is paid once rather than on every resize_pdf call
+_workers = []
+
+
+def _page_workers(page_count: int):
+    """
+    Returns worker processes for rasterizing multi-page documents, starting them on
+    first use. PyMuPDF is not thread-safe, so pages are spread across processes
+    rather than threads. The "spawn" start method avoids forking a process that is
+    running Qt threads. Each executor has exactly one process, so a page range sent
+    to it always lands in the same page cache.
+
+    Args:
+        page_count (int): The number of pages in the document.
+
+    Returns:
+        list: The executors to use, or None when parallelism would not help.
+    """
+    count = min(os.cpu_count() or 1, page_count)
+    if count < 2:
+        return None
+    while len(_workers) < count:
+        _workers.append(ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")))
+    return _workers[:count]
+
+
+def _release_page_workers(workers) -> None:
+    """
+    Drops the page caches of the given workers (and of this process) once a resize
+    is done, keeping the processes themselves for the next one.
+
+    Args:
+        workers (list): Executors returned by _page_workers, or None.
+    """
+    _clear_page_cache()
+    for worker in workers or ():
+        try:
+            worker.submit(_clear_page_cache)
+        except (BrokenProcessPool, RuntimeError):
+            _shutdown_page_workers()
+            break
+
+
+def _shutdown_page_workers() -> None:
+    """Shuts down all worker processes; new ones are started on demand."""
+    for worker in _workers:
+        worker.shutdown(wait=False)
+    _workers.clear()
+
+
+def _build_raster_doc(page_images: list) -> fitz.Document:
+    """
+    Builds a new PDF with one page per compressed page image.
+
+    Args:
+        page_images (list): (width, height, jpeg_bytes) tuples, in page order.
+
+    Returns:
+        fitz.Document: The new in-memory document. The caller must close it.
+    """
+    doc_new = fitz.open()
+    for width, height, img_bytes in page_images:
+        # Insert the compressed image into the new document
+        new_page = doc_new.new_page(width=width, height=height)
+        # Passing the dimensions skips PyMuPDF's decode probe of the image stream
+        new_page.insert_image(new_page.rect, stream=img_bytes, width=width, height=height)
+    return doc_new
+
+
+def _search_scale_factor(input_path: str, page_count: int, target_kb: int, low: float = 0.2, high: float = 1.0,
+                         iterations: int = 5, min_quality: int = 30, min_step: float = 0.02,
+                         workers=None) -> float:
+    """
+    Searches the page rasterization scale for the largest scale at which the
+    document still fits within target_kb at the lowest searched JPEG quality.
+    Encoded size grows roughly with the square of the scale, so the full-resolution
+    probe predicts the fitting scale directly; binary search below that prediction
+    is only used when the prediction does not fit.
+
+    Args:
+        input_path (str): The path to the input PDF file.
+        page_count (int): The number of pages in the document.
+        target_kb (int): The target file size in kilobytes.
+        low (float): The smallest scale factor to consider.
+        high (float): The largest scale factor to consider.
+        iterations (int): The maximum number of bisection steps for the fallback search.
+        min_quality (int): The JPEG quality used for every probe.
+        min_step (float): Bisection stops once the interval is narrower than this.
+        workers (list, optional): Worker processes used to encode pages in parallel.
+
+    Returns:
+        float: The best scale factor found, or None if even the smallest one is too large.
+    """
+    def size_at(scale_factor):
+        doc_new = _build_raster_doc(_encode_pages(input_path, page_count, scale_factor, min_quality, workers))
+        size_kb = len(doc_new.tobytes(garbage=4, deflate=True, clean=True)) / 1024
+        doc_new.close()
+        logger.debug("Test scale %.2f -> %.2f KB (Target: %s KB)", scale_factor, size_kb, target_kb)
+        return size_kb
+
+    # Full resolution is the best possible outcome, so check it first
+    full_size_kb = size_at(high)
+    if full_size_kb <= target_kb:
+        return high
+
+    # Jump straight to the predicted scale (with a 5% margin) and verify it
+    predicted = max(low, high * math.sqrt(target_kb / full_size_kb) * 0.95)
+    if size_at(predicted) <= target_kb:
+        return predicted
+    if predicted <= low:
+        # The smallest allowed scale is already too large
+        return None
+
+    best_scale = None
+    high = predicted
+    for _ in range(iterations):
+        # Steps finer than min_step no longer change the output noticeably
+        if high - low < min_step:
+            break
+        mid = (low + high) / 2
+        if size_at(mid) <= target_kb:
+            best_scale = mid
+            low = mid
+        else:
+            high = mid
+
+    # Bisection only probes midpoints, so the smallest scale itself is still untested
+    if best_scale is None and size_at(low) <= target_kb:
+        best_scale = low
+    return best_scale
+
+
+def _predict_quality(probed_sizes: dict, target_kb: float, low: int, high: int) -> int:
+    """
+    Predicts the quality that produces target_kb by fitting a line through the two
+    most recent (quality, size) probes. JPEG size grows smoothly and monotonically
+    with quality, so a linear fit lands close enough to verify with one more probe.
+
+    Args:
+        probed_sizes (dict): Maps each probed quality (int) to its size in KB.
+        target_kb (float): The target file size in kilobytes.
+        low (int): The lowest allowed quality.
+        high (int): The highest allowed quality.
+
+    Returns:
+        int: The predicted quality, clamped to [low, high].
+    """
+    (q1, s1), (q2, s2) = list(probed_sizes.items())[-2:]
+    if s1 == s2:
+        return high if s1 <= target_kb else low
+    predicted = q1 + (target_kb - s1) * (q2 - q1) / (s2 - s1)
+    return int(max(low, min(high, predicted)))
+
+
+# Winning rasterization quality per (input_path, mtime, target_kb, scale_factor), so
+# repeated resizes of the same PDF verify one probe instead of searching again
+# (least recently used entries are evicted beyond _QUALITY_CACHE_SIZE)
+_quality_cache = OrderedDict()
+_QUALITY_CACHE_SIZE = 128
+
+
+def _rasterize_to_target(input_path: str, output_path: str, target_kb: int, scale_factor: float = 0.8,
+                         workers=None) -> bool:
+    """
+    Rasterize PDF pages to images and search the JPEG quality for the best quality
+    that results in a file size <= target_kb. Two probes calibrate a linear
+    quality-to-size model whose prediction is verified directly; binary search
+    over the remaining range is only used when the prediction misses. The winning
+    quality is remembered in _quality_cache and tried first on the next call with the
+    same input, target and scale.
 
     Args:
         input_path (str): The path to the input PDF file.
         output_path (str): The final destination path for the resized PDF.
         target_kb (int): The target file size in kilobytes.
         scale_factor (float): The factor by which to scale down the page resolution.
+        workers (list, optional): Worker processes used to encode pages in parallel.
 
     Returns:
         bool: True if a suitable file was created, False otherwise.
     """
-    doc_original = fitz.open(input_path)
+    with fitz.open(input_path) as doc_original:
+        page_count = len(doc_original)
     # UPDATED: Changed upper limit of search range from 95 to 99
     low, high = 30, 99  # JPEG quality range (PyMuPDF usually handles 1-100)
+    tolerance = 0.03  # Results within 3% of the target are accepted as converged
     best_size = float("inf")
-    best_file_to_keep = None
-    tested_temp_files = []
+    best_bytes = None
+    best_quality = None
+    best_pages = None
+    probed_sizes = {}
+    cache_key = (input_path, int(os.path.getmtime(input_path)), target_kb, round(scale_factor, 4))
+
+    def probe(quality):
+        nonlocal best_size, best_bytes, best_quality, best_pages
+        page_images = _encode_pages(input_path, page_count, scale_factor, quality, workers)
+        doc_new = _build_raster_doc(page_images)
+
+        # Serialize the test PDF in memory; only the winner is written to disk
+        pdf_bytes = doc_new.tobytes(garbage=4, deflate=True, clean=True)
+        doc_new.close()
+
+        size_kb = len(pdf_bytes) / 1024
+        probed_sizes[quality] = size_kb
+        logger.debug("Test quality %d -> %.2f KB (Target: %s KB)", quality, size_kb, target_kb)
+
+        # Track best candidate (closest to target but not exceeding)
+        if size_kb <= target_kb and abs(size_kb - target_kb) < abs(best_size - target_kb):
+            best_size = size_kb
+            best_bytes = pdf_bytes
+            best_quality = quality
+            best_pages = page_images
+        return size_kb
+
+    def converged():
+        return abs(best_size - target_kb) / target_kb < tolerance
 
     try:
-        while low <= high:
-            mid = (low + high) // 2
-            # Create a unique temporary path for this quality test
-            temp_path = output_path + f".q{mid}.tmp"
-            tested_temp_files.append(temp_path)
-
-            doc_new = fitz.open()
-            for page_num in range(len(doc_original)):
-                page = doc_original.load_page(page_num)
-                # Create the transformation matrix based on scale factor
-                matrix = fitz.Matrix(scale_factor, scale_factor)
-                
-                # Get the rasterized page at reduced resolution
-                pix = page.get_pixmap(matrix=matrix, alpha=False)
+        # Pages are rendered once per scale and kept in the page cache of the process
+        # that encodes them (each worker always gets the same page range): only the
+        # JPEG quality changes between probes, so the same renders serve every probe.
+        #
+        # A previous run on the same file already found the winner: verify it
+        # with a single probe and only search if it no longer fits
+        cached_quality = _quality_cache.get(cache_key)
+        if cached_quality is not None:
+            _quality_cache.move_to_end(cache_key)
+        if cached_quality is not None and probe(cached_quality) <= target_kb:
+            logger.debug("Reusing cached quality %d", cached_quality)
+        else:
+            # Calibrate the size model with two probes, then verify its prediction,
+            # stepping down once if the prediction lands just over the target
+            for quality in (85, 55):
+                if quality not in probed_sizes:
+                    probe(quality)
+            if not converged():
+                predicted = _predict_quality(probed_sizes, target_kb, low, high)
+                for quality in (predicted, predicted - 5):
+                    if quality < low:
+                        break
+                    size_kb = probed_sizes[quality] if quality in probed_sizes else probe(quality)
+                    if size_kb <= target_kb:
+                        break
 
-                # Save image as JPEG with given quality (uses _get_compressed_jpeg_bytes for cleanup)
-                img_bytes = _get_compressed_jpeg_bytes(pix, mid)
-                
-                # Insert the compressed image into the new document
-                new_page = doc_new.new_page(width=pix.width, height=pix.height)
-                new_page.insert_image(new_page.rect, stream=img_bytes)
+        # Fall back to binary search below the lowest quality that was too large
+        if best_bytes is None:
+            high = min(probed_sizes) - 1
+            while low <= high and not converged():
+                mid = (low + high) // 2
+                if probe(mid) <= target_kb:
+                    # Since we are below the target, we can try higher quality (larger size)
+                    low = mid + 1
+                else:
+                    # We exceeded the target, so we must reduce quality (smaller size)
+                    high = mid - 1
 
-            # Save the test PDF
-            doc_new.save(temp_path, garbage=4, deflate=True, clean=True)
+        # Losslessly re-optimize only the winning page JPEGs (mozjpeg scan and Huffman
+        # tuning); the pixels are unchanged, so the result still meets the target
+        if best_bytes is not None and mozjpeg_lossless_optimization is not None:
+            doc_new = _build_raster_doc([(width, height, mozjpeg_lossless_optimization.optimize(img_bytes))
+                                         for width, height, img_bytes in best_pages])
+            pdf_bytes = doc_new.tobytes(garbage=4, deflate=True, clean=True)
             doc_new.close()
+            if len(pdf_bytes) < len(best_bytes):
+                best_bytes = pdf_bytes
+                best_size = len(pdf_bytes) / 1024
 
-            size_kb = os.path.getsize(temp_path) / 1024
-            print(f"Test quality {mid} → {size_kb:.2f} KB (Target: {target_kb} KB)")
-
-            # Track best candidate (closest to target but not exceeding)
-            if size_kb <= target_kb:
-                if abs(size_kb - target_kb) < abs(best_size - target_kb):
-                    best_size = size_kb
-                    best_file_to_keep = temp_path
-                # Since we are below the target, we can try higher quality (larger size)
-                low = mid + 1
-            else:
-                # We exceeded the target, so we must reduce quality (smaller size)
-                high = mid - 1
-        
-        doc_original.close()
-
-        # If we found a good candidate, rename it to the final output path
-        if best_file_to_keep:
-            # First, clean up all the other temporary test files
-            for test_file in tested_temp_files:
-                if test_file != best_file_to_keep and os.path.exists(test_file):
-                    os.remove(test_file)
-            
-            # Rename the best candidate to the final output path
-            os.rename(best_file_to_keep, output_path)
-            print(f"Final size achieved: {os.path.getsize(output_path) / 1024:.2f} KB")
+        # If we found a good candidate, write it to the final output path
+        if best_bytes is not None:
+            with open(output_path, "wb") as f:
+                f.write(best_bytes)
+            _quality_cache[cache_key] = best_quality
+            _quality_cache.move_to_end(cache_key)
+            while len(_quality_cache) > _QUALITY_CACHE_SIZE:
+                _quality_cache.popitem(last=False)
+            logger.debug("Final size achieved: %.2f KB", best_size)
             return True
         
         # If no suitable file was found in the 30-99 range
         return False
         
     except Exception as e:
-        print(f"Error during PDF rasterization and binary search: {e}")
-        doc_original.close()
+        logger.error("Error during PDF rasterization and binary search: %s", e)
         return False
-    finally:
-        # Ensure all temporary test files are cleaned up upon exit, regardless of success/failure
-        for test_file in tested_temp_files:
-            if os.path.exists(test_file) and test_file != output_path:
-                try:
-                    os.remove(test_file)
-                except:
-                    pass # Ignore errors during cleanup
 
-# --- Existing resize_image function (no change) ---
+# --- Image Resizing Logic ---
+
+# Opaque PNGs above this many pixels are treated as photographs and saved as JPEG
+_PHOTO_PNG_PIXELS = 400_000
+
+
+def _is_photographic_png(img: Image.Image, output_path: str) -> bool:
+    """
+    Decides whether a PNG should be re-encoded as JPEG: photographs compress several
+    times better as JPEG, but transparency would be lost. An explicit .png output
+    path always keeps PNG.
+
+    Args:
+        img (Image.Image): The opened PNG image.
+        output_path (str): The path the resized image will be saved to.
+
+    Returns:
+        bool: True if the image is large and fully opaque.
+    """
+    if output_path.lower().endswith('.png') or img.width * img.height <= _PHOTO_PNG_PIXELS:
+        return False
+    if 'transparency' in img.info:
+        return False
+    if img.mode in ('RGBA', 'LA', 'PA'):
+        return img.getchannel('A').getextrema() == (255, 255)
+    return True
+
+
+def _trial_encoder(img: Image.Image, save_format: str, buffer: BytesIO):
+    """
+    Returns a function that encodes img at a given quality and reports the size.
+    Trial encodes skip the extra optimization passes for speed. When PyTurboJPEG is
+    installed, JPEG trials encode the raw pixel array directly with libjpeg-turbo,
+    bypassing Pillow's per-call setup; otherwise the shared buffer is reused.
+
+    Args:
+        img (Image.Image): The image to encode.
+        save_format (str): 'JPEG' or 'PNG'.
+        buffer (BytesIO): A reusable buffer for Pillow encodes.
+
+    Returns:
+        callable: A function taking a quality (int) and returning the size in KB.
+    """
+    if _turbo_jpeg is not None and save_format == 'JPEG' and img.mode in ('RGB', 'L'):
+        # Materialize the pixel array once per image, not once per trial
+        if img.mode == 'RGB':
+            pixels = np.asarray(img)
+            options = {"pixel_format": TJPF_RGB, "jpeg_subsample": TJSAMP_420}
+        else:
+            pixels = np.asarray(img)[:, :, np.newaxis]
+            options = {"pixel_format": TJPF_GRAY, "jpeg_subsample": TJSAMP_GRAY}
+        return lambda quality: len(_turbo_jpeg.encode(pixels, quality=quality, **options)) / 1024
+
+    def encode(quality):
+        buffer.seek(0)
+        buffer.truncate()
+        img.save(buffer, format=save_format, quality=quality, optimize=False)
+        return buffer.tell() / 1024
+    return encode
+
+
+def _search_image_quality(trial_size_kb, target_kb: float, low: int = 10, high: int = 95,
+                          known_sizes: dict = None) -> tuple:
+    """
+    Searches for a high JPEG quality whose encode fits within target_kb. Two probes
+    (q=85 and q=40) calibrate a linear quality-to-size model; its prediction is
+    verified with one encode, stepping down by 5 once if it lands just over.
+
+    Args:
+        trial_size_kb (callable): Encodes at a given quality and returns the size in KB.
+        target_kb (float): The target file size in kilobytes.
+        low (int): The lowest allowed quality.
+        high (int): The highest allowed quality. Equal bounds probe once.
+        known_sizes (dict, optional): Sizes in KB already measured at this resolution,
+            keyed by quality, which are reused instead of re-encoding.
+
+    Returns:
+        tuple: (best_quality, smallest_size_kb). best_quality is the highest probed
+            quality that fits, or None if none did.
+    """
+    probed_sizes = dict(known_sizes or {})
+
+    def probe(quality):
+        if quality not in probed_sizes:
+            probed_sizes[quality] = trial_size_kb(quality)
+        return probed_sizes[quality]
+
+    if low == high:
+        probe(low)
+    else:
+        probe(min(high, 85))
+        probe(max(low, 40))
+        predicted = _predict_quality(probed_sizes, target_kb, low, high)
+        for quality in (predicted, predicted - 5):
+            if quality < low or probe(quality) <= target_kb:
+                break
+
+    fitting = [quality for quality, size_kb in probed_sizes.items() if size_kb <= target_kb]
+    return (max(fitting) if fitting else None), min(probed_sizes.values())
+
+
+def _resize_image_vips(input_path: str, output_path: str, target_kb: int, aspect_ratio: tuple = None) -> bool:
+    """
+    pyvips implementation of resize_image, used when pyvips is installed. libvips
+    resamples with SIMD kernels on a demand-driven pipeline, which is considerably
+    faster than Pillow for large images. The search strategy matches resize_image.
+
+    Args:
+        input_path (str): The path to the input image file.
+        output_path (str): The path to save the resized image.
+        target_kb (int): The target file size in kilobytes.
+        aspect_ratio (tuple, optional): A tuple (W, H) for the desired aspect ratio. Defaults to None.
+
+    Returns:
+        bool: True if the resize was successful, False otherwise.
+    """
+    # Opening only reads the header, so the decode can still be sized below
+    img = pyvips.Image.new_from_file(input_path)
+    loader = img.get('vips-loader')
+    save_format = 'PNG' if loader.startswith('png') else 'JPEG'
+
+    # Shrink-on-load: libjpeg can decode at 1/2, 1/4 or 1/8 scale in the DCT
+    # domain. The shrink is sized from the same bytes-per-pixel estimate as the
+    # draft() call in resize_image, with the same 2x margin in each dimension.
+    shrink = 1
+    source_bytes = os.path.getsize(input_path)
+    if loader.startswith('jpeg') and source_bytes > target_kb * 1024:
+        height_per_width = img.height / img.width
+        if aspect_ratio and aspect_ratio[0] > 0 and aspect_ratio[1] > 0:
+            height_per_width = aspect_ratio[1] / aspect_ratio[0]
+        ratio = math.sqrt(target_kb * 1024 / source_bytes * img.height / (img.width * height_per_width))
+        while shrink < 8 and ratio * 2 * shrink * 2 <= 1:
+            shrink *= 2
+    if shrink > 1:
+        img = pyvips.Image.new_from_file(input_path, access='sequential', shrink=shrink)
+    else:
+        img = pyvips.Image.new_from_file(input_path, access='sequential')
+
+    # Large, fully opaque PNGs are photographs as far as compression goes (see
+    # _is_photographic_png); save them as JPEG
+    if (save_format == 'PNG' and not output_path.lower().endswith('.png')
+            and img.width * img.height > _PHOTO_PNG_PIXELS):
+        opaque = True
+        if img.hasalpha():
+            # Reading the alpha consumes a sequential image, so load it first
+            img = img.copy_memory()
+            opaque = img.extract_band(img.bands - 1).min() >= (65535 if img.format == 'ushort' else 255)
+        if opaque:
+            save_format = 'JPEG'
+
+    # JPEG cannot store alpha, so drop the alpha band once up front
+    if save_format == 'JPEG' and img.hasalpha():
+        img = img.extract_band(0, n=img.bands - 1)
+
+    # Match resize_image, which saves JPEG as RGB or L: convert CMYK, Lab and
+    # 16-bit images to 8-bit sRGB (or greyscale)
+    if save_format == 'JPEG' and img.interpretation not in ('srgb', 'b-w'):
+        img = img.colourspace('b-w' if img.interpretation == 'grey16' else 'srgb')
+
+    if aspect_ratio:
+        ratio_w, ratio_h = aspect_ratio
+        if ratio_w > 0 and ratio_h > 0:
+            new_height = int(img.width * (ratio_h / ratio_w))
+            img = img.resize(1, vscale=new_height / img.height, kernel='lanczos3')
+
+    # Sequential images can only be read once; keep the pixels for repeated encodes
+    source_img = img.copy_memory()
+    width, height = source_img.width, source_img.height
+
+    def encode(image, quality, final=False):
+        if save_format == 'PNG':
+            return image.pngsave_buffer(compression=9 if final else 6, strip=True)
+        return image.jpegsave_buffer(Q=quality, optimize_coding=final, interlace=final, strip=True)
+
+    # Downscale once from a single q=85 probe before searching quality, as in resize_image
+    scale = min(1.0, math.sqrt(target_kb * 1.1 / (len(encode(source_img, 85)) / 1024)))
+    if scale >= 0.99:
+        scale = 1.0
+    # As in resize_image, trial downscales use a cheap linear kernel since they only
+    # predict the encoded size; lanczos3 is applied once to the accepted scale
+    img = source_img.resize(scale, kernel='linear') if scale < 1.0 else source_img
+
+    while True:
+        low, high = (10, 95) if save_format == 'JPEG' else (95, 95)
+        best_quality, current_size_kb = _search_image_quality(
+            lambda quality: len(encode(img, quality)) / 1024, target_kb, low, high)
+
+        if best_quality is not None:
+            final_img = img if img is source_img else source_img.resize(scale, kernel='lanczos3')
+            img_bytes = encode(final_img, best_quality, final=True)
+            if len(img_bytes) / 1024 > target_kb:
+                img_bytes = encode(img, best_quality)
+            with open(output_path, 'wb') as f:
+                f.write(img_bytes)
+            return True
+
+        scale *= min(0.9, math.sqrt(target_kb / current_size_kb))
+        if int(width * scale) == 0 or int(height * scale) == 0:
+            return False
+        img = source_img.resize(scale, kernel='linear')
+
 
 def resize_image(input_path: str, output_path: str, target_kb: int, aspect_ratio: tuple = None) -> bool:
     """
@@ -146,51 +864,144 @@ def resize_image(input_path: str, output_path: str, target_kb: int, aspect_ratio
     Returns:
         bool: True if the resize was successful, False otherwise.
     """
+    if pyvips is not None:
+        try:
+            return _resize_image_vips(input_path, output_path, target_kb, aspect_ratio)
+        except Exception as e:
+            # Any failure (libvips errors, bad targets, unwritable output) falls back to
+            # the Pillow path, which reports it and returns False if it fails there too
+            logger.warning("pyvips resize failed, falling back to Pillow: %s", e)
+
     try:
         img = Image.open(input_path)
         img_format = img.format if img.format in ['JPEG', 'PNG'] else 'JPEG'
+        save_format = 'JPEG' if img_format != 'PNG' else 'PNG'
+        if save_format == 'PNG' and _is_photographic_png(img, output_path):
+            save_format = 'JPEG'
+
+        # Work out the aspect-ratio target from the header alone, before any pixels
+        # are decoded, so the decode itself can be sized for it.
         original_width, original_height = img.size
-        
+        height_per_width = original_height / original_width
         if aspect_ratio:
             ratio_w, ratio_h = aspect_ratio
             if ratio_w > 0 and ratio_h > 0:
-                new_height = int(original_width * (ratio_h / ratio_w))
-                img = img.resize((original_width, new_height), Image.Resampling.LANCZOS)
-        
-        current_width, current_height = img.size
-        quality = 95
-        
+                height_per_width = ratio_h / ratio_w
+
+        # Opening is lazy, so for JPEG sources far larger than the target we can ask
+        # libjpeg to downscale by 1/2, 1/4 or 1/8 in the DCT domain while decoding.
+        # The pixel budget is estimated from the source's own bytes per pixel over the
+        # aspect-corrected area, and doubled in each dimension since draft() never goes
+        # below the requested size.
+        source_bytes = os.path.getsize(input_path)
+        if img.format == 'JPEG' and source_bytes > target_kb * 1024:
+            aspect_height = original_width * height_per_width
+            ratio = math.sqrt(target_kb * 1024 / source_bytes * original_height / aspect_height)
+            img.draft(img.mode, (int(original_width * ratio * 2), int(original_height * ratio * 2)))
+
+        # JPEG cannot store alpha or palettes, so convert once up front
+        if save_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+
+        if aspect_ratio and height_per_width != original_height / original_width:
+            new_height = max(1, int(img.width * height_per_width))
+            img = img.resize((img.width, new_height), Image.Resampling.LANCZOS)
+
+        # A single buffer is reused (rewound and truncated) for every trial encode,
+        # since only the encoded size is needed until the final save.
+        buffer = BytesIO()
+
+        # Downscale first, then search quality: one probe at q=85 predicts the scale
+        # at which the target is reachable (size grows with pixel count), so oversized
+        # images are not repeatedly encoded at full resolution.
+        probe_kb = _trial_encoder(img, save_format, buffer)(85)
+        width, height = img.size
+
+        # Every downscale resamples from this image rather than from the previous
+        # result, so filter blur never compounds across iterations. Trial resizes
+        # only need to predict the encoded size, so they use the cheaper BILINEAR
+        # filter; LANCZOS is applied once to the accepted dimensions.
+        source_img = img
+        scale = min(1.0, math.sqrt(target_kb * 1.1 / probe_kb))
+        known_sizes = None
+
+        if scale < 0.99:
+            img = source_img.resize((max(1, int(width * scale)), max(1, int(height * scale))),
+                                    Image.Resampling.BILINEAR)
+        else:
+            scale = 1.0
+            if save_format == 'JPEG':
+                # The probe already measured q=85 at this size, so reuse it in the search
+                known_sizes = {85: probe_kb}
+
         while True:
-            buffer = BytesIO()
-            save_format = 'JPEG' if img_format != 'PNG' else 'PNG'
-            
-            img.save(buffer, format=save_format, quality=quality, optimize=True)
-            current_size_kb = buffer.tell() / 1024
-            
-            if current_size_kb <= target_kb or quality <= 10:
+            # Search for the highest quality that fits within the target.
+            # PNG ignores the quality setting, so a single encode is enough there.
+            low, high = (10, 95) if save_format == 'JPEG' else (95, 95)
+            best_quality, current_size_kb = _search_image_quality(
+                _trial_encoder(img, save_format, buffer), target_kb, low, high, known_sizes)
+            known_sizes = None
+
+            if best_quality is not None:
+                # reducing_gap first box-reduces by an integer factor, so LANCZOS only
+                # runs over the last, small step of the downscale
+                final_img = img if img is source_img else source_img.resize(
+                    img.size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+                # Re-encode the accepted quality once with optimized Huffman tables
+                # (and progressive scans for JPEG), which almost always shrinks the file.
+                # The final encode streams straight to disk rather than through a buffer.
+                # Trial sizes may come from a different encoder (libjpeg-turbo) and
+                # image (BILINEAR), so the written size is checked and the JPEG quality
+                # stepped down until it fits.
+                quality = best_quality
                 with open(output_path, 'wb') as f:
-                    f.write(buffer.getvalue())
-                return True
-            
-            if quality > 60:
-                quality -= 5
-            else:
-                current_width = int(current_width * 0.9)
-                current_height = int(current_height * 0.9)
-                if current_width == 0 or current_height == 0:
-                    return False
-                img = img.resize((current_width, current_height), Image.Resampling.LANCZOS)
+                    while True:
+                        f.seek(0)
+                        f.truncate()
+                        if save_format == 'JPEG':
+                            final_img.save(f, format='JPEG', quality=quality,
+                                           optimize=True, progressive=True, subsampling=2)
+                        else:
+                            final_img.save(f, format='PNG', optimize=True)
+                        current_size_kb = f.tell() / 1024
+                        if current_size_kb <= target_kb:
+                            return True
+
+                        if save_format == 'PNG':
+                            # PNG ignores quality: write the exact encode the search measured
+                            f.seek(0)
+                            f.truncate()
+                            img.save(f, format='PNG', optimize=False)
+                            return True
+                        quality -= 2
+                        if quality < low:
+                            break
+
+                # Even the lowest quality is over the target: downscale further below
+                os.remove(output_path)
+
+            # No quality setting reached the target. Size scales with pixel count, so
+            # solve for the scale directly from the smallest probe (at least a 10% step).
+            scale *= min(0.9, math.sqrt(target_kb / current_size_kb))
+            current_width = int(width * scale)
+            current_height = int(height * scale)
+            if current_width == 0 or current_height == 0:
+                return False
+            img = source_img.resize((current_width, current_height), Image.Resampling.BILINEAR)
                 
     except Exception as e:
-        print(f"Error resizing image: {e}")
+        logger.error("Error resizing image: %s", e)
         return False
 
 
 def resize_pdf(input_path: str, output_path: str, target_kb: int) -> bool:
     """
-    Resizes a PDF using a two-pass strategy:
+    Resizes a PDF using a multi-pass strategy:
+    0. Lossless: Recompress the original streams, images and fonts as-is.
     1. Non-destructive: Compress embedded images and optimize structure.
-    2. Destructive (Fallback): Rasterize and downscale using binary search on quality.
+    2. Destructive (Fallback): Rasterize at the largest page scale that fits, found by
+       binary search, then binary search on quality.
     
     Args:
         input_path (str): The path to the input PDF file.
@@ -201,53 +1012,118 @@ def resize_pdf(input_path: str, output_path: str, target_kb: int) -> bool:
         bool: True if the resize was successful, False otherwise.
     """
     
-    # --- PASS 1: Non-destructive Image Compression & Optimization ---
     try:
+        # Already within the target: keep the original untouched
+        if os.path.getsize(input_path) <= target_kb * 1024:
+            shutil.copyfile(input_path, output_path)
+            logger.debug("Input already within target (%s KB); copied as-is.", target_kb)
+            return True
+
         doc = fitz.open(input_path)
+
+        # --- PASS 0: Lossless stream compression of the original objects ---
+        # Keeps vector and text content intact; built in memory so nothing is
+        # written unless it already meets the target.
+        pdf_bytes = doc.tobytes(garbage=4, clean=True, deflate=True,
+                                deflate_images=True, deflate_fonts=True)
+        current_size_kb = len(pdf_bytes) / 1024
+        logger.debug("Pass 0 (Lossless Opt) size: %.2f KB (Target: %s KB)", current_size_kb, target_kb)
+
+        if current_size_kb <= target_kb:
+            doc.close()
+            with open(output_path, "wb") as f:
+                f.write(pdf_bytes)
+            return True
+
+        # --- PASS 1: Non-destructive Image Compression & Optimization ---
         image_quality = 85
-        
-        # 1a. Compress existing images in place
+        probe_interval = 8  # Check the running size after every 8 recompressed images
+        # Running size estimate: Pass 0 size minus the bytes each replacement saves.
+        # Pass 0 already deflated some streams, so this errs low, and it is only used
+        # to skip serializations whose result can not fit yet.
+        estimated_size = len(pdf_bytes)
+        del pdf_bytes
+
+        # 1a. Collect each embedded image once: the same xref is often referenced
+        # from many pages (logos, headers), and recompressing it again would only
+        # re-encode the already recompressed stream
+        xrefs = {}
         for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            for img in page.get_images(full=True):
-                xref = img[0]
-                if xref > 0:
-                    try:
-                        pix = fitz.Pixmap(doc, xref)
-                        if pix.n >= 4:  
-                            pix = fitz.Pixmap(fitz.csRGB, pix)
-                        
-                        img_bytes = _get_compressed_jpeg_bytes(pix, image_quality)
-                        
-                        doc.update_image(xref, img_bytes)
-                        pix = None
-                    except Exception as e:
-                        print(f"Skipping problematic image {xref} on page {page_num}: {e}")
-                        continue
-                        
-        # 1b. Save with aggressive general PDF optimizations
-        doc.save(output_path, garbage=4, deflate=True, clean=True)
+            for img in doc.get_page_images(page_num, full=True):
+                if img[0] > 0:
+                    xrefs.setdefault(img[0], page_num)
+
+        def apply_updates(updates):
+            # Write a batch of recompressed streams back into the document
+            for xref, img_bytes in updates.items():
+                try:
+                    _replace_image_stream(doc, xref, img_bytes)
+                except Exception as e:
+                    logger.warning("Skipping problematic image %d on page %d: %s", xref, xrefs[xref], e)
+            updates.clear()
+
+        # 1b. Recompress them, applying the new streams in batches
+        updates = {}
+        for xref, page_num in xrefs.items():
+            try:
+                img_bytes = _recompress_xref(doc, xref, image_quality)
+            except Exception as e:
+                logger.warning("Skipping problematic image %d on page %d: %s", xref, page_num, e)
+                continue
+            if img_bytes is None:
+                continue
+            length_type, length = doc.xref_get_key(xref, "Length")
+            original_length = int(length) if length_type == "int" else len(doc.xref_stream_raw(xref))
+            estimated_size -= original_length - len(img_bytes)
+            updates[xref] = img_bytes
+            if len(updates) < probe_interval or estimated_size > target_kb * 1024:
+                continue
+
+            # Stop recompressing as soon as the document fits; a cheap
+            # garbage=1 serialization is enough to check the size
+            apply_updates(updates)
+            pdf_bytes = doc.tobytes(garbage=1, deflate=True)
+            if len(pdf_bytes) <= target_kb * 1024:
+                doc.close()
+                with open(output_path, "wb") as f:
+                    f.write(pdf_bytes)
+                logger.debug("Pass 1 reached target early: %.2f KB", len(pdf_bytes) / 1024)
+                return True
+        apply_updates(updates)
+
+        # 1c. Serialize with aggressive general PDF optimizations; like Pass 0 this
+        # stays in memory, so a miss leaves nothing on disk for Pass 2 to clean up
+        pdf_bytes = doc.tobytes(garbage=4, deflate=True, clean=True)
+        page_count = len(doc)
         doc.close()
         
-        current_size_kb = os.path.getsize(output_path) / 1024
-        print(f"Pass 1 (Image Comp/Opt) size: {current_size_kb:.2f} KB (Target: {target_kb} KB)")
+        current_size_kb = len(pdf_bytes) / 1024
+        logger.debug("Pass 1 (Image Comp/Opt) size: %.2f KB (Target: %s KB)", current_size_kb, target_kb)
         
         if current_size_kb <= target_kb:
+            with open(output_path, "wb") as f:
+                f.write(pdf_bytes)
             return True
+        del pdf_bytes
 
         # --- PASS 2: Destructive Rasterization/Downscaling Fallback (using Binary Search) ---
-        print("Pass 1 failed to reach target. Applying aggressive rasterization with binary search.")
-        
-        # If Pass 1 file exists, delete it before starting Pass 2, as Pass 2 will create the final file
-        if os.path.exists(output_path):
-            os.remove(output_path)
+        logger.debug("Pass 1 failed to reach target. Applying aggressive rasterization with binary search.")
 
-        # Call the new binary search function
-        return _rasterize_to_target(input_path, output_path, target_kb)
+        # Find the largest page scale that can reach the target, then search the
+        # JPEG quality at that scale. Both searches share the same worker processes.
+        workers = _page_workers(page_count)
+        try:
+            scale_factor = _search_scale_factor(input_path, page_count, target_kb, workers=workers)
+            if scale_factor is None:
+                return False
+            return _rasterize_to_target(input_path, output_path, target_kb, scale_factor, workers)
+        finally:
+            # Release the cached page renders' sample memory; the workers stay up
+            _release_page_workers(workers)
 
     except Exception as e:
         error_message = f"PDF processing failed: {e}"
-        print(f"Error resizing PDF: {e}")
+        logger.error("Error resizing PDF: %s", e)
         
         # Cleanup any partial files
         if os.path.exists(output_path):